@@ -1,11 +1,21 @@
 from flask import Flask, render_template, request, redirect, session, url_for, jsonify
-import requests
+import httpx
+import asyncio
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
 import urllib.parse
 import base64
 import secrets
 import os
+import time
 from datetime import datetime, timedelta
+from itertools import islice
+import ijson
 import json
+import logging
+import orjson
+
+logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', secrets.token_hex(16))
@@ -16,9 +26,36 @@ SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET')
 SPOTIFY_REDIRECT_URI = 'http://localhost:5000/callback'
 SPOTIFY_SCOPE = 'user-follow-read playlist-modify-public playlist-modify-private user-read-private'
 
+# Credentials are fixed for the app's lifetime, so the token endpoint and the
+# Basic auth header it needs can be computed once at import time
+SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+TOKEN_REQUEST_HEADERS = {
+    'Authorization': 'Basic ' + base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode(),
+    'Content-Type': 'application/x-www-form-urlencoded'
+}
+
+# Thread-pool width for concurrent playlist POSTs; with HTTP/2 the workers
+# multiplex as streams over the client's shared connections
+MAX_WORKERS = 8
+
+def _json(response):
+    """Decode a requests response body with orjson (faster than stdlib json)"""
+    return orjson.loads(response.content)
+
 class SpotifyAPI:
     def __init__(self):
         self.base_url = 'https://api.spotify.com/v1'
+
+        # Persistent HTTP/2 client: concurrent requests multiplex onto one or
+        # two connections instead of needing a pooled connection apiece
+        self.session = httpx.Client(
+            headers={'Accept': 'application/json'},
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+            )
+        )
     
     def get_auth_url(self):
         """Generate Spotify authorization URL"""
@@ -38,49 +75,70 @@ class SpotifyAPI:
     
     def get_access_token(self, code):
         """Exchange authorization code for access token"""
-        auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
-        
-        headers = {
-            'Authorization': f'Basic {auth_header}',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
         data = {
             'grant_type': 'authorization_code',
             'code': code,
             'redirect_uri': SPOTIFY_REDIRECT_URI
         }
-        
-        response = requests.post('https://accounts.spotify.com/api/token', headers=headers, data=data)
-        return response.json()
-    
+
+        response = self.session.post(SPOTIFY_TOKEN_URL, headers=TOKEN_REQUEST_HEADERS, data=data)
+        return _json(response)
+
     def refresh_access_token(self, refresh_token):
         """Refresh the access token"""
-        auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
-        
-        headers = {
-            'Authorization': f'Basic {auth_header}',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
         data = {
             'grant_type': 'refresh_token',
             'refresh_token': refresh_token
         }
-        
-        response = requests.post('https://accounts.spotify.com/api/token', headers=headers, data=data)
-        return response.json()
-    
+
+        response = self.session.post(SPOTIFY_TOKEN_URL, headers=TOKEN_REQUEST_HEADERS, data=data)
+        return _json(response)
+
+    def ensure_fresh_token(self):
+        """Refresh the session's access token if it expires within the next minute"""
+        expires_at = session.get('token_expires_at')
+
+        if expires_at and expires_at - datetime.now().timestamp() > 60:
+            return
+
+        self.refresh_session_token()
+
+    def refresh_session_token(self):
+        """Refresh the access token stored in the Flask session, returning the new token"""
+        refresh_token = session.get('refresh_token')
+        if not refresh_token:
+            return None
+
+        token_data = self.refresh_access_token(refresh_token)
+        if 'access_token' not in token_data:
+            return None
+
+        session['access_token'] = token_data['access_token']
+        if token_data.get('refresh_token'):
+            session['refresh_token'] = token_data['refresh_token']
+        session['token_expires_at'] = (datetime.now() + timedelta(seconds=token_data.get('expires_in', 3600))).timestamp()
+
+        return token_data['access_token']
+
     def make_request(self, endpoint, access_token, params=None):
         """Make authenticated request to Spotify API"""
         headers = {'Authorization': f'Bearer {access_token}'}
-        response = requests.get(f"{self.base_url}{endpoint}", headers=headers, params=params)
-        
+        response = self.session.get(f"{self.base_url}{endpoint}", headers=headers, params=params)
+
         if response.status_code == 401:
-            # Token expired, need to refresh
-            return None
-        
-        return response.json()
+            # Token expired mid-flight: refresh once and retry instead of
+            # returning None, which silently truncated callers' results
+            new_token = self.refresh_session_token()
+            if not new_token:
+                return None
+
+            headers['Authorization'] = f'Bearer {new_token}'
+            response = self.session.get(f"{self.base_url}{endpoint}", headers=headers, params=params)
+
+            if response.status_code == 401:
+                return None
+
+        return _json(response)
     
     def get_followed_artists(self, access_token, limit=50):
         """Get user's followed artists"""
@@ -134,32 +192,291 @@ class SpotifyAPI:
             'public': False
         }
         
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/users/{user_id}/playlists",
             headers=headers,
             json=data
         )
-        return response.json()
+        return _json(response)
     
+    def _post_tracks_batch(self, playlist_id, headers, batch):
+        """POST one batch of track URIs, backing off and retrying on 429"""
+        url = f"{self.base_url}/playlists/{playlist_id}/tracks"
+
+        for attempt in range(3):
+            response = self.session.post(url, headers=headers, json={'uris': batch})
+
+            if response.status_code != 429:
+                response.raise_for_status()
+                return
+
+            # Honor Spotify's Retry-After, falling back to exponential backoff
+            time.sleep(float(response.headers.get('Retry-After', 2 ** attempt)))
+
+        response.raise_for_status()
+
     def add_tracks_to_playlist(self, access_token, playlist_id, track_uris):
         """Add tracks to playlist"""
         headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
-        
-        # Spotify allows max 100 tracks per request
-        for i in range(0, len(track_uris), 100):
-            batch = track_uris[i:i+100]
-            data = {'uris': batch}
-            
-            requests.post(
-                f"{self.base_url}/playlists/{playlist_id}/tracks",
-                headers=headers,
-                json=data
-            )
+
+        # Spotify allows max 100 tracks per request; the batches are
+        # independent, so POST them concurrently over the pooled session
+        batches = [track_uris[i:i+100] for i in range(0, len(track_uris), 100)]
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            list(executor.map(lambda batch: self._post_tracks_batch(playlist_id, headers, batch), batches))
     
     def get_user_profile(self, access_token):
         """Get user profile information"""
         return self.make_request('/me', access_token)
 
+class _AsyncStreamAdapter:
+    """Wraps an async byte iterator in the file-like read() interface ijson expects"""
+
+    def __init__(self, byte_iterator):
+        self._byte_iterator = byte_iterator
+        self._buffer = b''
+        self._exhausted = False
+
+    async def read(self, size=-1):
+        if size == 0:
+            return b''
+
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            try:
+                self._buffer += await self._byte_iterator.__anext__()
+            except StopAsyncIteration:
+                self._exhausted = True
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return data
+
+# Process-local caches for lookups that are stable across users and requests.
+# Keys are bare Spotify IDs since these responses don't depend on who is asking.
+related_artists_cache = TTLCache(maxsize=50_000, ttl=86400)  # stable on the order of weeks
+artist_albums_cache = TTLCache(maxsize=50_000, ttl=3600)     # 1 h so new releases are picked up
+album_cache = TTLCache(maxsize=50_000, ttl=86400)            # released albums don't change
+
+class AsyncSpotifyAPI:
+    """Async variant of SpotifyAPI for the read-heavy fan-out in playlist generation"""
+
+    def __init__(self, concurrency=20):
+        self.base_url = 'https://api.spotify.com/v1'
+        self.concurrency = concurrency
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._session = httpx.AsyncClient(
+            headers={'Accept': 'application/json'},
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+            )
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.aclose()
+
+    async def make_request(self, endpoint, access_token, params=None):
+        """Make authenticated request to Spotify API"""
+        headers = {'Authorization': f'Bearer {access_token}'}
+
+        # Semaphore keeps at most `concurrency` requests in flight (Spotify rate limits)
+        async with self._semaphore:
+            response = await self._session.get(f"{self.base_url}{endpoint}", headers=headers, params=params)
+
+        if response.status_code == 401:
+            # Token expired, need to refresh
+            return None
+
+        return orjson.loads(response.content)
+
+    async def get_followed_artists(self, access_token, limit=50):
+        """Get user's followed artists, prefetching the next page while the current one is processed"""
+        params = {'type': 'artist', 'limit': limit}
+        data = await self.make_request('/me/following', access_token, params)
+
+        artists = []
+        while data:
+            block = data['artists']
+
+            # Cursor pagination can't be parallelized outright, but the next
+            # round-trip can overlap with processing the current page
+            next_page = None
+            if block['next']:
+                next_page = asyncio.ensure_future(
+                    self.make_request('/me/following', access_token,
+                                      dict(params, after=block['cursors']['after']))
+                )
+
+            artists.extend(block['items'])
+
+            if next_page is None:
+                break
+
+            data = await next_page
+
+        return artists
+
+    async def get_related_artists(self, access_token, artist_id):
+        """Get related artists (Fans also like)"""
+        if artist_id in related_artists_cache:
+            return related_artists_cache[artist_id]
+
+        data = await self.make_request(f'/artists/{artist_id}/related-artists', access_token)
+        if not data:
+            return []
+
+        related_artists_cache[artist_id] = data['artists']
+        return data['artists']
+
+    async def get_artist_albums(self, access_token, artist_id, limit=20):
+        """Get artist's recent albums and singles"""
+        if (artist_id, limit) in artist_albums_cache:
+            return artist_albums_cache[(artist_id, limit)]
+
+        params = {
+            'include_groups': 'album,single',
+            'market': 'US',
+            'limit': limit
+        }
+        data = await self.make_request(f'/artists/{artist_id}/albums', access_token, params)
+        if not data:
+            return []
+
+        artist_albums_cache[(artist_id, limit)] = data['items']
+        return data['items']
+
+    async def _fetch_albums_chunk(self, access_token, chunk):
+        """Stream-decode one bulk /albums response, keeping only the fields we use"""
+        headers = {'Authorization': f'Bearer {access_token}'}
+        params = {'ids': ','.join(chunk), 'market': 'US'}
+
+        albums = []
+        async with self._semaphore:
+            async with self._session.stream('GET', f"{self.base_url}/albums", headers=headers, params=params) as response:
+                if response.status_code != 200:
+                    return albums
+
+                # ijson yields each album as its bytes arrive, so the full
+                # response tree (images, copyrights, available_markets, ...)
+                # is never materialized; slim each album down to what the
+                # playlist builder actually reads before caching it
+                reader = _AsyncStreamAdapter(response.aiter_bytes())
+                async for album in ijson.items(reader, 'albums.item'):
+                    if album:  # the bulk endpoint returns null for unknown IDs
+                        albums.append({
+                            'id': album['id'],
+                            'name': album['name'],
+                            'artists': [{'name': artist['name']} for artist in album['artists']],
+                            'release_date': album['release_date'],
+                            'tracks': {'items': [{'uri': track['uri'], 'name': track['name']}
+                                                 for track in album['tracks']['items']]}
+                        })
+
+        return albums
+
+    async def get_albums_bulk(self, access_token, album_ids):
+        """Get full albums (tracks included) in batches of 20 via the bulk endpoint"""
+        albums_by_id = {album_id: album_cache[album_id] for album_id in album_ids if album_id in album_cache}
+        missing = [album_id for album_id in album_ids if album_id not in albums_by_id]
+
+        chunks = [missing[i:i+20] for i in range(0, len(missing), 20)]
+        results = await asyncio.gather(
+            *(self._fetch_albums_chunk(access_token, chunk) for chunk in chunks)
+        )
+
+        for albums in results:
+            for album in albums:
+                album_cache[album['id']] = album
+                albums_by_id[album['id']] = album
+
+        return [albums_by_id[album_id] for album_id in album_ids if album_id in albums_by_id]
+
+async def collect_recent_tracks(access_token, one_week_ago):
+    """Fan out over followed/related artists concurrently and collect recent tracks"""
+    async with AsyncSpotifyAPI() as api:
+        followed_artists = await api.get_followed_artists(access_token)
+        app.logger.info("Found %d followed artists", len(followed_artists))
+
+        # Dict keys dedupe like a set but keep insertion order, so followed
+        # artists stay ahead of related ones when the 50-artist cap applies
+        all_artists = {}
+        for artist in followed_artists:
+            all_artists[artist['id']] = None
+
+        # Only fan out to related artists when the followed list is thin;
+        # a healthy follow list already yields plenty of candidates, and
+        # skipping the expansion saves one API call per followed artist
+        if len(followed_artists) < 20:
+            related_lists = await asyncio.gather(
+                *(api.get_related_artists(access_token, artist['id']) for artist in followed_artists)
+            )
+
+            for related_artists in related_lists:
+                for related in related_artists[:5]:  # Limit to 5 related artists per followed artist
+                    all_artists[related['id']] = None
+
+        app.logger.info("Total artists to check: %d", len(all_artists))
+
+        # Album listings for up to 50 artists, fetched concurrently; limit=5
+        # is enough since results are newest-first and we only want last week
+        album_lists = await asyncio.gather(
+            *(api.get_artist_albums(access_token, artist_id, limit=5)
+              for artist_id in islice(all_artists, 50))  # Limit to 50 artists to avoid rate limits
+        )
+
+        # Keep only albums released in the last week. release_date is always
+        # YYYY, YYYY-MM or YYYY-MM-DD; once partial dates are padded, plain
+        # string comparison orders the same as parsed dates, so the hot loop
+        # does no int conversion or datetime work at all
+        cutoff = one_week_ago.strftime('%Y-%m-%d')
+        recent_albums = []
+        seen_album_ids = set()
+        for albums in album_lists:
+            for album in albums:
+                # The same album can appear under several artists (collabs,
+                # related-artist overlap); process it once
+                if album['id'] in seen_album_ids:
+                    continue
+                seen_album_ids.add(album['id'])
+
+                rd = album['release_date']
+                # Pad partial dates to the end of their period so a year- or
+                # month-precision release date isn't ruled out prematurely
+                if len(rd) == 4:
+                    rd += '-12-31'
+                elif len(rd) == 7:
+                    rd += '-31'
+
+                if rd >= cutoff:
+                    recent_albums.append(album)
+
+        # Bulk-fetch the surviving albums; each comes back with its tracks,
+        # so 20 albums cost one round-trip instead of 20
+        full_albums = await api.get_albums_bulk(access_token, [album['id'] for album in recent_albums])
+
+    recent_tracks = []
+    for album in full_albums:
+        for track in album['tracks']['items']:
+            recent_tracks.append({
+                'uri': track['uri'],
+                'name': track['name'],
+                'artist': album['artists'][0]['name'],
+                'album': album['name'],
+                'release_date': album['release_date']
+            })
+
+    return recent_tracks
+
 spotify_api = SpotifyAPI()
 
 @app.route('/')
@@ -192,8 +509,13 @@ def callback():
     if 'access_token' in token_data:
         session['access_token'] = token_data['access_token']
         session['refresh_token'] = token_data.get('refresh_token')
-        session['token_expires_at'] = datetime.now() + timedelta(seconds=token_data.get('expires_in', 3600))
-        
+        session['token_expires_at'] = (datetime.now() + timedelta(seconds=token_data.get('expires_in', 3600))).timestamp()
+
+        # Cache the user id now so playlist generation doesn't refetch /me
+        user_profile = spotify_api.get_user_profile(token_data['access_token'])
+        if user_profile:
+            session['user_id'] = user_profile['id']
+
         return redirect(url_for('dashboard'))
     else:
         return f"Failed to get access token: {token_data}"
@@ -203,7 +525,9 @@ def dashboard():
     """Main dashboard after authentication"""
     if 'access_token' not in session:
         return redirect(url_for('login'))
-    
+
+    spotify_api.ensure_fresh_token()
+
     # Get user profile
     user_profile = spotify_api.get_user_profile(session['access_token'])
     if not user_profile:
@@ -216,77 +540,51 @@ def generate_playlist():
     """Generate playlist with recent releases from followed and related artists"""
     if 'access_token' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
-    
+
+    spotify_api.ensure_fresh_token()
     access_token = session['access_token']
     
     try:
-        # Get followed artists
-        followed_artists = spotify_api.get_followed_artists(access_token)
-        print(f"Found {len(followed_artists)} followed artists")
-        
-        # Collect all artists (followed + related)
-        all_artists = set()
-        for artist in followed_artists:
-            all_artists.add(artist['id'])
-            
-            # Get related artists (limit to 5 per followed artist to avoid too many)
-            related_artists = spotify_api.get_related_artists(access_token, artist['id'])
-            for related in related_artists[:5]:  # Limit to 5 related artists per followed artist
-                all_artists.add(related['id'])
-        
-        print(f"Total artists to check: {len(all_artists)}")
-        
-        # Get recent releases (last 7 days)
+        # Get recent releases (last 7 days), fanning out the API calls concurrently
         one_week_ago = datetime.now() - timedelta(days=7)
-        recent_tracks = []
-        
-        for artist_id in list(all_artists)[:50]:  # Limit to 50 artists to avoid rate limits
-            albums = spotify_api.get_artist_albums(access_token, artist_id, limit=10)
-            
-            for album in albums:
-                # Check if album was released in the last week
-                release_date = datetime.strptime(album['release_date'], '%Y-%m-%d' if len(album['release_date']) == 10 else '%Y')
-                
-                if release_date >= one_week_ago:
-                    tracks = spotify_api.get_album_tracks(access_token, album['id'])
-                    for track in tracks:
-                        recent_tracks.append({
-                            'uri': track['uri'],
-                            'name': track['name'],
-                            'artist': album['artists'][0]['name'],
-                            'album': album['name'],
-                            'release_date': album['release_date']
-                        })
-        
+        recent_tracks = asyncio.run(collect_recent_tracks(access_token, one_week_ago))
+
         if not recent_tracks:
             return jsonify({'message': 'No recent releases found from the last week'})
         
-        # Create playlist
-        user_profile = spotify_api.get_user_profile(access_token)
+        # Create playlist; the user id was cached in the session at login
+        user_id = session.get('user_id')
+        if not user_id:
+            user_id = spotify_api.get_user_profile(access_token)['id']
+            session['user_id'] = user_id
+
         playlist_name = f"Weekly Discoveries - {datetime.now().strftime('%Y-%m-%d')}"
         playlist_description = f"Recent releases from your followed artists and their related artists (last 7 days). Generated on {datetime.now().strftime('%Y-%m-%d')}"
         
         playlist = spotify_api.create_playlist(
             access_token,
-            user_profile['id'],
+            user_id,
             playlist_name,
             playlist_description
         )
         
-        # Add tracks to playlist
-        track_uris = [track['uri'] for track in recent_tracks]
+        # Add tracks to playlist, deduplicating URIs (the same track often
+        # appears on both a single and an album) while preserving order
+        seen = set()
+        track_uris = [uri for uri in (track['uri'] for track in recent_tracks)
+                      if not (uri in seen or seen.add(uri))]
         spotify_api.add_tracks_to_playlist(access_token, playlist['id'], track_uris)
         
         return jsonify({
             'success': True,
             'playlist_name': playlist_name,
             'playlist_url': playlist['external_urls']['spotify'],
-            'tracks_added': len(recent_tracks),
+            'tracks_added': len(track_uris),
             'tracks': recent_tracks[:10]  # Return first 10 tracks for preview
         })
         
     except Exception as e:
-        print(f"Error generating playlist: {str(e)}")
+        app.logger.exception("Error generating playlist")
         return jsonify({'error': f'Failed to generate playlist: {str(e)}'}), 500
 
 @app.route('/logout')